@@ -1,8 +1,7 @@
 import argparse
 from enum import Enum, auto
-from typing import List
+from typing import List, Tuple
 from dotenv import load_dotenv
-import openai
 import os
 from pathlib import Path
 
@@ -21,25 +20,32 @@ from prompt_toolkit.widgets import (
     TextArea,
 )
 
+from singularity import code, daemon, llm, profiling, routing, watcher
 from singularity.autocomplete import prompt
-from singularity.code import show_code, summarize_codebase
 from singularity.color_scheme import Colors
-from singularity.llm import Message, llm_api
-from singularity.logs import Log, get_title, print
+from singularity.ingest import describe_stored, ingest
+from singularity.llm import Message
+from singularity.logs import Log, collect_garbage, get_title, print, saved_logs
 
 
 load_dotenv()  # Load the OpenAI API key from a .env file
-openai.api_key = os.getenv("OPENAI_API_KEY")
 
 
 # Define command-line arguments
 parser = argparse.ArgumentParser(description="Talk to LLM assistant")
 # parser.add_argument("--model", type=str, default="gpt-4-32k", help="model to use")
 # parser.add_argument("--model", type=str, default="gpt-4", help="model to use")
-parser.add_argument("--model", type=str, default="gpt-3.5-turbo", help="model to use")
+parser.add_argument("--model", type=str, default="gpt-3.5-turbo", help="model to use, or 'auto' to pick one per request")
 # parser.add_argument("--model", type=str, default="text-davinci-003", help="model to use")
 parser.add_argument("--temperature", type=float, default=1, help="Sampling temperature for generating text")
+parser.add_argument("--serve", action="store_true", help="run a daemon that keeps caches warm for other sessions")
+parser.add_argument("--daemon", action="store_true", help="connect to a running daemon if there is one")
+parser.add_argument("--watch", action="store_true", help="keep the codebase summary current in the background")
+parser.add_argument("--profile", action="store_true", help="write a profile of every turn")
+parser.add_argument("--profile-dir", type=Path, default=profiling.default_profile_dir, help="where to write profiles")
+parser.add_argument("--socket", type=Path, default=daemon.default_socket_path, help="daemon socket path")
 args = parser.parse_args()
+profiler = profiling.TurnProfiler(args.profile_dir, enabled=args.profile)
 
 
 class LoopStatus(Enum):
@@ -115,6 +121,26 @@ def file_checkbox_dialog(files: List[str]):
     app.run()
 
 
+def ingest_file(directory: Path, rel_filepath: Path, log: Log) -> Tuple[str, str]:
+    """
+    Reads a whole file in chunks, returning the part that fits in the context and a note
+    listing the chunks stored for later.
+    """
+    try:
+        with open(directory / rel_filepath) as f:
+            content, stored = ingest(f, log, str(rel_filepath))
+    except IsADirectoryError:
+        print(f"Path is a directory: {rel_filepath}\n", Colors.info)
+        return "", ""
+    except FileNotFoundError:
+        print(f"File not found: {rel_filepath}\n", Colors.info)
+        return "", ""
+    note = "" if len(stored) == 0 else "\n" + describe_stored(stored)
+    if content == "":
+        note = note.lstrip()
+    return content, note
+
+
 def parse_user_input(user_input: str, log: Log) -> LoopStatus:
     if user_input == "/exit":
         return LoopStatus.Break
@@ -125,12 +151,20 @@ def parse_user_input(user_input: str, log: Log) -> LoopStatus:
     elif user_input == "/log":
         log.print()
         return LoopStatus.Continue
+    elif user_input == "/history":
+        log.print_history()
+        return LoopStatus.Continue
     elif user_input == "/copy":
         message = log.log[-1].content
         os.system(f'echo "{message}" | pbcopy')
         return LoopStatus.Continue
     elif user_input == "/paste":
-        content = os.popen("pbpaste").read().strip()
+        label = f"paste{len({chunk_id.split('#')[0] for chunk_id in log.chunks})}"
+        with os.popen("pbpaste") as paste:
+            content, stored = ingest(paste, log, label)
+        content = content.strip()
+        if len(stored) > 0:
+            content = (content + "\n\n" + describe_stored(stored)).strip()
         message = Message(
             role="user",
             content=content,
@@ -143,29 +177,34 @@ def parse_user_input(user_input: str, log: Log) -> LoopStatus:
         log.rename(name)
         return LoopStatus.Continue
     elif user_input == "/load":
-        saved_logs = [f for f in os.listdir(log.save_dir)]
+        log_files = saved_logs(log.save_dir)
         logs_text = "\n".join([
             f"{i}: {get_title(log.save_dir / Path(f))}"
-            for i, f in enumerate(saved_logs)
+            for i, f in enumerate(log_files)
         ])  + "\n\nSelect saved log: "
         result = input_dialog(title="Select saved log", text=logs_text).run()
         if result is None:
             print("No log loaded.\n", Colors.alert)
         else:
             try:
-                log.load(log.save_dir / saved_logs[int(result)])
+                log.load(log.save_dir / log_files[int(result)])
             except Exception:
                 print("Invalid selection.\n", Colors.alert)
         return LoopStatus.Continue
+    elif user_input == "/gc":
+        n_removed = collect_garbage(log.save_dir)
+        print(f"Removed {n_removed} unreferenced message bodies.\n", Colors.alert)
+        return LoopStatus.Continue
     elif user_input == "/clear":
         log.clear()
         return LoopStatus.Continue
     elif user_input.startswith("/code"):
         # TODO: switch to a toggle-based system where I flag what to keep in the preamble, and recalculate it every message
-        codebase_summary = summarize_codebase()
+        codebase_summary = code.summarize_codebase()
         message = Message(
             role="user",
             content="```\n" + codebase_summary + "```",
+            source="codebase",
             # content=(
                 # "```\n" + codebase_summary + "```" +
                 # "This is a high-level codebase overview. You will need to see code in more detail "
@@ -186,19 +225,42 @@ def parse_user_input(user_input: str, log: Log) -> LoopStatus:
         # TODO: switch to a toggle-based system where I flag what to keep in the preamble, and recalculate it every message
         directory = Path(os.getcwd())
         show_args = user_input.split()[1].split(':')
-        code = (
-            show_code(directory, Path(show_args[0]), show_args[1], show_args[2])
-            if len(show_args) == 3
-            else show_code(directory, Path(show_args[0]), "", "")
-        )
-        if code != "":
+        if len(show_args) == 3 and (show_args[1] != "" or show_args[2] != ""):
+            shown_code = code.show_code(directory, Path(show_args[0]), show_args[1], show_args[2])
+            note = ""
+        else:
+            shown_code, note = ingest_file(directory, Path(show_args[0]), log)
+        if shown_code != "" or note != "":
+            # Even if no chunk fit, say which ones were stored so they can be added later
+            message = Message(
+                role="user",
+                content=("" if shown_code == "" else "```\n" + shown_code + "```") + note,
+                source=":".join(show_args) if len(show_args) == 3 else f"{show_args[0]}::",
+            )
+            log.append(message)
+            print(message, Colors.info)
+        return LoopStatus.Continue
+    elif user_input.startswith("/chunk"):
+        chunk_id = " ".join(user_input.split()[1:])
+        content = log.read_chunk(chunk_id)
+        if content is None:
+            print(f"No stored chunk {chunk_id}.\n", Colors.alert)
+        else:
             message = Message(
                 role="user",
-                content="```\n" + code + "```",
+                content=content,
             )
             log.append(message)
             print(message, Colors.info)
         return LoopStatus.Continue
+    elif user_input.startswith("/profile"):
+        setting = " ".join(user_input.split()[1:])
+        if setting not in ["on", "off"]:
+            print("Usage: /profile on|off\n", Colors.alert)
+        else:
+            profiler.enabled = setting == "on"
+            print(f"Profiling {setting}.\n", Colors.alert)
+        return LoopStatus.Continue
     elif user_input == "/undo":
         log.undo()
         return LoopStatus.Continue
@@ -225,12 +287,17 @@ def parse_response(response: str, log: Log) -> LoopStatus:
         if user_input.lower() == "y":
             directory = Path(os.getcwd())
             show_args = response.split()[1].split(':')
-            code = show_code(directory, Path(show_args[0]), show_args[1], show_args[2])
-            print(code, Colors.info)
+            if show_args[1] != "" or show_args[2] != "":
+                shown_code = code.show_code(directory, Path(show_args[0]), show_args[1], show_args[2])
+            else:
+                shown_code, note = ingest_file(directory, Path(show_args[0]), log)
+                shown_code += note
+            print(shown_code, Colors.info)
             log.append(
                 Message(
                     role="user",
-                    content=code,
+                    content=shown_code,
+                    source=response.split()[1],
                 )
             )
         else:
@@ -245,7 +312,34 @@ def parse_response(response: str, log: Log) -> LoopStatus:
         return LoopStatus.NoAction
 
 
+def run_turn(user_input: str, log: Log) -> LoopStatus:
+    loop_status = parse_user_input(user_input, log)
+    if loop_status != LoopStatus.NoAction:
+        return loop_status
+    model = routing.select_model(log.model, log.length)
+    response = llm.llm_api(log.context, model, args.temperature)
+    served_by = f" ({model})" if log.model == routing.auto_model else ""
+    print(f"\nAssistant{served_by}: {response}\n", Colors.assistant, indent=2)
+    log.append(
+        Message(
+            role="assistant",
+            content=response.strip(),
+        )
+    )
+    return parse_response(response, log)
+
+
 def main():
+    if args.serve:
+        daemon.serve(args.socket, args.watch)
+        return
+    client = daemon.connect(args.socket) if args.daemon else None
+    if args.daemon and client is None:
+        print(f"No daemon listening on {args.socket}, running standalone.\n", Colors.alert)
+    if client is not None:
+        daemon.use_daemon(client)
+    elif args.watch:
+        watcher.watch(Path(os.getcwd()))
     print(
         f"You are now talking to the {args.model} model. "
         "Enter '/exit' to end the conversation.\n",
@@ -255,20 +349,18 @@ def main():
     while True:
         # no newline
         user_input = prompt("You: ")
-        loop_status = parse_user_input(user_input, log)
-        if loop_status == LoopStatus.Break:
-            break
-        elif loop_status == LoopStatus.Continue:
-            continue
-        response = llm_api(log.log, args.model, args.temperature)
-        print(f"\nAssistant: {response}\n", Colors.assistant, indent=2)
-        log.append(
-            Message(
-                role="assistant",
-                content=response.strip(),
+        loop_status = (
+            profiler.run(
+                run_turn,
+                user_input,
+                log,
+                skip=lambda loop_status: loop_status == LoopStatus.Break,
             )
+            if profiler.enabled
+            else run_turn(user_input, log)
         )
-        parse_response(response, log)
+        if loop_status == LoopStatus.Break:
+            break
 
 
 if __name__ == "__main__":
@@ -9,15 +9,19 @@ from singularity.color_scheme import prompt_style
 commands = [
     ("/exit", "end the conversation"),
     ("/log", "show the conversation log"),
+    ("/history", "show the full saved log, including pruned messages"),
     ("/name", "[name] change the conversation name"),
     ("/load", "load conversation log from file"),
     ("/clear", "clear log"),
+    ("/gc", "delete saved message bodies no log refers to"),
     ("/code", "upload codebase from current directory"),
     ("/show", "[filepath]:[optional-class]:[optional-function] show code snippet"),
     ("/undo", "delete last user message"),
     ("/set_model", "set LLM model to use"),
     ("/copy", "copy last assistant response to clipboard"),
     ("/paste", "paste from clipboard"),
+    ("/profile", "[on|off] write a profile of each turn"),
+    ("/chunk", "[chunk-id] add a stored chunk of a large paste or file"),
     # TODO: implement /issues to look at issue tracker
     # TODO: implement /ask to text user
     # TODO: implement /write <file>:<function_or_class> to overwrite function or class
@@ -70,6 +74,7 @@ class CommandCompleter(Completer):
                     "gpt-3.5-turbo",
                     "gpt-4",
                     "gpt-4-32k",
+                    "auto",
                 ]
             ]
             for suggestion in suggestions:
@@ -1,23 +1,145 @@
 import ast
 import os
 from pathlib import Path
-from typing import List
+from threading import RLock
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
 
 from singularity.color_scheme import Colors
 from singularity.logs import Log, print
 
 
+class CachedFile(NamedTuple):
+    mtime_ns: int
+    size: int
+    contents: str
+    tree: ast.Module
+
+
+class CodebaseIndex:
+    """
+    Parsed files and per-file summaries for one directory, reused until a file's
+    modification time or size changes. While a watcher keeps the index up to date,
+    cached files are trusted without checking the file system.
+    """
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.files: Dict[Path, CachedFile] = {}
+        self.summaries: Dict[Tuple[Path, bool], Tuple[CachedFile, str]] = {}
+        self.watched = False
+        self.lock = RLock()
+
+    def get(self, rel_filepath: Path) -> CachedFile:
+        with self.lock:
+            cached_file = self.files.get(rel_filepath)
+            if self.watched and cached_file is not None and self.__covered__(rel_filepath):
+                return cached_file
+            stat = os.stat(self.directory / rel_filepath)
+            if (
+                cached_file is None
+                or cached_file.mtime_ns != stat.st_mtime_ns
+                or cached_file.size != stat.st_size
+            ):
+                with open(self.directory / rel_filepath) as f:
+                    file_contents = f.read()
+                cached_file = CachedFile(
+                    stat.st_mtime_ns,
+                    stat.st_size,
+                    file_contents,
+                    ast.parse(file_contents),
+                )
+                self.files[rel_filepath] = cached_file
+            return cached_file
+
+    def __covered__(self, rel_filepath: Path) -> bool:
+        """Whether a watcher would see the file change: inside the directory and not ignored."""
+        normalized = os.path.normpath(rel_filepath)
+        return (
+            not os.path.isabs(normalized)
+            and normalized.split(os.sep)[0] != ".."
+            and not is_ignored(normalized)
+        )
+
+    def summary(self, rel_filepath: Path, docstrings: bool) -> str:
+        with self.lock:
+            cached_file = self.get(rel_filepath)
+            cached_summary = self.summaries.get((rel_filepath, docstrings))
+            if cached_summary is not None and cached_summary[0] is cached_file:
+                return cached_summary[1]
+            print(f"Summarizing file: {rel_filepath}", Colors.info)
+            return self.__summarize__(rel_filepath, docstrings)
+
+    def __summarize__(self, rel_filepath: Path, docstrings: bool) -> str:
+        cached_file = self.get(rel_filepath)
+        file_summary = summarize_code(self.directory, rel_filepath, docstrings)
+        self.summaries[(rel_filepath, docstrings)] = (cached_file, file_summary)
+        return file_summary
+
+    def summarize(self, docstrings: bool) -> str:
+        with self.lock:
+            return "".join([
+                self.summary(rel_filepath, docstrings)
+                for rel_filepath in sorted(self.files)
+                if rel_filepath.suffix == ".py" and not is_ignored(str(rel_filepath))
+            ])
+
+    def forget(self, rel_dirpath: Path) -> None:
+        """Drops every cached file under a directory that was deleted or moved away."""
+        with self.lock:
+            for rel_filepath in list(self.files):
+                if rel_dirpath in rel_filepath.parents:
+                    self.files.pop(rel_filepath)
+            for rel_filepath, docstrings in list(self.summaries):
+                if rel_dirpath in rel_filepath.parents:
+                    self.summaries.pop((rel_filepath, docstrings))
+
+    def refresh(self, rel_filepath: Path) -> None:
+        """
+        Re-reads a changed file and rebuilds its summaries, or drops it if it is gone. A file
+        that no longer parses keeps its last good version until it changes again.
+        """
+        with self.lock:
+            cached_file = self.files.pop(rel_filepath, None)
+            summaries = {
+                docstrings: self.summaries.pop((rel_filepath, docstrings))
+                for docstrings in [True, False]
+                if (rel_filepath, docstrings) in self.summaries
+            }
+            try:
+                for docstrings in list(summaries) or [False]:
+                    self.__summarize__(rel_filepath, docstrings)
+            except OSError:
+                # Deleted or moved away
+                self.files.pop(rel_filepath, None)
+                for docstrings in [True, False]:
+                    self.summaries.pop((rel_filepath, docstrings), None)
+            except (SyntaxError, UnicodeDecodeError):
+                # Saved halfway through an edit
+                if cached_file is not None:
+                    self.files[rel_filepath] = cached_file
+                    for docstrings, summary in summaries.items():
+                        self.summaries[(rel_filepath, docstrings)] = summary
+
+
+codebase_indexes: Dict[Path, CodebaseIndex] = {}
+
+
+def get_index(directory: Path) -> CodebaseIndex:
+    if directory not in codebase_indexes:
+        codebase_indexes[directory] = CodebaseIndex(directory)
+    return codebase_indexes[directory]
+
+
 def show_code(directory: Path, rel_filepath: Path, cls_name: str, fn_name: str) -> str:
     try:
-        with open(directory / rel_filepath) as f:
-            file_contents = f.read()
-            root = ast.parse(file_contents)
+        cached_file = get_index(directory).get(rel_filepath)
     except IsADirectoryError:
         print(f"Path is a directory: {rel_filepath}\n", Colors.info)
         return ""
     except FileNotFoundError:
         print(f"File not found: {rel_filepath}\n", Colors.info)
         return ""
+    file_contents = cached_file.contents
+    root = cached_file.tree
 
     if cls_name == "" and fn_name == "":
         return file_contents
@@ -106,8 +228,7 @@ def summarize_code(directory: Path, rel_filepath: Path, docstrings: bool = False
     Returns:
         A formatted summary string of all public functions and classes, with docstrings.
     """
-    with open(directory / rel_filepath) as f:
-        root = ast.parse(f.read())
+    root = get_index(directory).get(rel_filepath).tree
 
     code_summary = [f"{rel_filepath}:"]
     # Classes
@@ -143,27 +264,39 @@ def summarize_code(directory: Path, rel_filepath: Path, docstrings: bool = False
     return "\n".join(code_summary) + "\n\n"
 
 
-def summarize_codebase(docstrings: bool = False) -> str:
+def is_ignored(root: str) -> bool:
+    return '.venv' in root or '__pycache__' in root
+
+
+def codebase_files(directory: Path) -> Iterator[Path]:
+    """Yields the paths, relative to the directory, of all Python files to summarize."""
+    for root, _, filenames in os.walk(directory):
+        if is_ignored(root): continue
+        for filename in filenames:
+            if not filename.endswith(".py"): continue
+            filepath = os.path.join(root, filename)
+            yield Path(filepath).resolve().relative_to(directory)
+
+
+def summarize_codebase(docstrings: bool = False, directory: Optional[Path] = None) -> str:
     """
     Summarizes all public functions and classes defined in the current directory.
 
     Args:
         docstrings: Whether to include docstrings in the summary.
+        directory: Directory to summarize instead of the current one.
 
     Returns:
         A formatted summary string of all code, with optional docstrings.
     """
-    directory = Path(os.getcwd())
+    if directory is None:
+        directory = Path(os.getcwd())
+    index = get_index(directory)
+    if index.watched:
+        return index.summarize(docstrings)
     codebase_summary = ""
-    for root, _, filenames in os.walk(directory):
-        if '.venv' in root or '__pycache__' in root: continue
-        for filename in filenames:
-            if not filename.endswith(".py"): continue
-            filepath = os.path.join(root, filename)
-            rel_filepath = Path(filepath).resolve().relative_to(directory)
-            print(f"Summarizing file: {rel_filepath}", Colors.info)
-            file_summary = summarize_code(directory, rel_filepath, docstrings)
-            codebase_summary += file_summary
+    for rel_filepath in sorted(codebase_files(directory)):
+        codebase_summary += index.summary(rel_filepath, docstrings)
     return codebase_summary
 
 
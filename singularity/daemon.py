@@ -0,0 +1,194 @@
+from contextlib import contextmanager
+import io
+import json
+import os
+from pathlib import Path
+import socket
+import socketserver
+import sys
+from threading import Lock, local
+from typing import Any, Callable, Dict, Iterator, List, Optional, TextIO
+
+from singularity import code, llm, watcher
+from singularity.color_scheme import Colors
+from singularity.llm import Message
+from singularity.logs import print
+
+
+default_socket_path = Path.home() / ".singularity.sock"
+watch_directories = False
+
+
+# Requests the daemon answers, each taking JSON-friendly keyword arguments
+def __llm_api(messages: List[Dict[str, str]], model: str, temperature: float) -> str:
+    return llm.llm_api([Message(**m) for m in messages], model, temperature)
+
+
+def __summarize_codebase(docstrings: bool, directory: str) -> str:
+    if watch_directories:
+        watcher.watch(Path(directory))
+    return code.summarize_codebase(docstrings, Path(directory))
+
+
+def __show_code(directory: str, rel_filepath: str, cls_name: str, fn_name: str) -> str:
+    if watch_directories:
+        watcher.watch(Path(directory))
+    return code.show_code(Path(directory), Path(rel_filepath), cls_name, fn_name)
+
+
+def __count_tokens(text: str, model: str) -> int:
+    return llm.count_tokens(text, model)
+
+
+def __encoding_name(model: str) -> str:
+    return llm.encoding_name(model)
+
+
+handlers: Dict[str, Callable[..., Any]] = {
+    "llm_api": __llm_api,
+    "summarize_codebase": __summarize_codebase,
+    "show_code": __show_code,
+    "count_tokens": __count_tokens,
+    "encoding_name": __encoding_name,
+}
+
+
+class RequestOutput:
+    """
+    Stands in for sys.stdout in the daemon, so that what a request prints (missing files,
+    summarizing progress) is sent back to the client that made it.
+    """
+    def __init__(self, stdout: TextIO):
+        self.stdout = stdout
+        self.local = local()
+
+    def write(self, text: str) -> int:
+        return getattr(self.local, "buffer", self.stdout).write(text)
+
+    def flush(self) -> None:
+        self.stdout.flush()
+
+    @contextmanager
+    def capture(self) -> Iterator[io.StringIO]:
+        self.local.buffer = io.StringIO()
+        try:
+            yield self.local.buffer
+        finally:
+            del self.local.buffer
+
+
+request_output = RequestOutput(sys.stdout)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            request = json.loads(line)
+            with request_output.capture() as output:
+                try:
+                    reply = {"result": handlers[request["op"]](**request["args"])}
+                except Exception as e:
+                    reply = {"error": f"{type(e).__name__}: {e}"}
+            reply["output"] = output.getvalue()
+            self.wfile.write((json.dumps(reply) + "\n").encode())
+            self.wfile.flush()
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(socket_path: Path = default_socket_path, watch: bool = False) -> None:
+    """
+    Runs the daemon in the foreground. The backend client, tokenizers and codebase indexes
+    live in this process and stay warm for every REPL that connects. With `watch`, each
+    directory a client asks about gets a file watcher keeping its index current.
+    """
+    global watch_directories
+    watch_directories = watch
+    sys.stdout = request_output
+    if socket_path.exists():
+        if connect(socket_path) is not None:
+            print(f"A daemon is already listening on {socket_path}.\n", Colors.alert)
+            return
+        socket_path.unlink()
+    with DaemonServer(str(socket_path), RequestHandler) as server:
+        print(f"Daemon listening on {socket_path}.\n", Colors.info)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            socket_path.unlink()
+
+
+class DaemonClient:
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.file = sock.makefile("rwb")
+        self.lock = Lock()
+        self.encoding_names: Dict[str, str] = {}
+
+    def request(self, op: str, **kwargs) -> Any:
+        with self.lock:
+            self.file.write((json.dumps({"op": op, "args": kwargs}) + "\n").encode())
+            self.file.flush()
+            reply = json.loads(self.file.readline())
+        # Printed by the daemon while handling the request, already colored
+        sys.stdout.write(reply.get("output", ""))
+        if "error" in reply:
+            raise RuntimeError(f"Daemon error: {reply['error']}")
+        return reply["result"]
+
+    def llm_api(self, messages: List[Message], model: str, temperature: float) -> str:
+        return self.request(
+            "llm_api",
+            messages=[m.api_dict for m in messages],
+            model=model,
+            temperature=temperature,
+        )
+
+    def summarize_codebase(self, docstrings: bool = False, directory: Optional[Path] = None) -> str:
+        if directory is None:
+            directory = Path(os.getcwd())
+        return self.request("summarize_codebase", docstrings=docstrings, directory=str(directory))
+
+    def show_code(self, directory: Path, rel_filepath: Path, cls_name: str, fn_name: str) -> str:
+        return self.request(
+            "show_code",
+            directory=str(directory),
+            rel_filepath=str(rel_filepath),
+            cls_name=cls_name,
+            fn_name=fn_name,
+        )
+
+    def count_tokens(self, text: str, model: str) -> int:
+        return self.request("count_tokens", text=text, model=model)
+
+    def encoding_name(self, model: str) -> str:
+        # Asked for on every Message.token_count, so answered locally after the first time
+        if model not in self.encoding_names:
+            self.encoding_names[model] = self.request("encoding_name", model=model)
+        return self.encoding_names[model]
+
+
+def connect(socket_path: Path = default_socket_path) -> Optional[DaemonClient]:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(socket_path))
+    except OSError:
+        sock.close()
+        return None
+    return DaemonClient(sock)
+
+
+def use_daemon(client: DaemonClient) -> None:
+    """
+    Routes model calls, token counting and code lookups through the daemon, so this process
+    never imports tiktoken.
+    """
+    llm.llm_api = client.llm_api
+    llm.count_tokens = client.count_tokens
+    llm.encoding_name = client.encoding_name
+    code.summarize_codebase = client.summarize_codebase
+    code.show_code = client.show_code
@@ -0,0 +1,99 @@
+from typing import Iterator, List, NamedTuple, TextIO, Tuple
+
+from singularity import llm
+from singularity.logs import Log
+
+
+default_chunk_tokens = 1000
+# Characters read and tokenized at a time; counting per line would cost a daemon round
+# trip per line, and reading whole lines would hold a minified file in memory at once
+piece_chars = 1024
+# Rough size of a token, for text past the ingestion budget that is stored uncounted
+chars_per_token = 4
+
+
+class Chunk(NamedTuple):
+    chunk_id: str
+    n_tokens: int
+
+
+def ingest_budget(log: Log) -> int:
+    """Tokens a single paste or file may add, leaving half the free context for replies."""
+    return max(0, log.prune_limit - log.length) // 2
+
+
+def read_pieces(stream: TextIO) -> Iterator[str]:
+    """
+    Reads text in pieces of at most `piece_chars` characters, cut after the last newline
+    where there is one, so that long lines are split as well.
+    """
+    rest = ""
+    while True:
+        block = stream.read(piece_chars - len(rest))
+        if block == "":
+            break
+        text = rest + block
+        cut = text.rfind("\n") + 1
+        if cut == 0:
+            cut = len(text)
+        yield text[:cut]
+        rest = text[cut:]
+    if rest != "":
+        yield rest
+
+
+def ingest(
+    stream: TextIO,
+    log: Log,
+    label: str,
+    chunk_tokens: int = default_chunk_tokens,
+) -> Tuple[str, List[Chunk]]:
+    """
+    Splits streamed text into chunks of about `chunk_tokens` tokens, counting tokens as it
+    reads. Leading chunks are returned while they fit the log's ingestion budget; every
+    later chunk goes to the blob store, addressable as "<label>#<n>" through Log.chunks.
+    Once the budget is used up, tokens are estimated from the length of the text instead
+    of counted.
+
+    Returns:
+        The text to attach, and the chunks that were stored instead.
+    """
+    budget = ingest_budget(log)
+    attached: List[str] = []
+    attached_tokens = 0
+    stored: List[Chunk] = []
+    chunk: List[str] = []
+    n_chunk_tokens = 0
+
+    def flush() -> None:
+        nonlocal attached_tokens, chunk, n_chunk_tokens
+        text = "".join(chunk)
+        if len(stored) == 0 and attached_tokens + n_chunk_tokens <= budget:
+            attached.append(text)
+            attached_tokens += n_chunk_tokens
+        else:
+            chunk_id = f"{label}#{len(attached) + len(stored)}"
+            log.chunks[chunk_id] = log.blobs.put(text)
+            stored.append(Chunk(chunk_id, n_chunk_tokens))
+        chunk = []
+        n_chunk_tokens = 0
+
+    for piece in read_pieces(stream):
+        chunk.append(piece)
+        if len(stored) == 0 and attached_tokens + n_chunk_tokens <= budget:
+            n_chunk_tokens += llm.count_tokens(piece, log.model)
+        else:
+            n_chunk_tokens += len(piece) // chars_per_token
+        if n_chunk_tokens >= chunk_tokens:
+            flush()
+    if len(chunk) > 0:
+        flush()
+    return "".join(attached), stored
+
+
+def describe_stored(stored: List[Chunk]) -> str:
+    n_tokens = sum([chunk.n_tokens for chunk in stored])
+    return (
+        f"[{len(stored)} chunks (about {n_tokens} tokens) did not fit in the context: "
+        f"{stored[0].chunk_id} to {stored[-1].chunk_id}. Load one with /chunk <id>.]"
+    )
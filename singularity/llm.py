@@ -1,23 +1,114 @@
-from dataclasses import dataclass
-import openai
+from functools import lru_cache
+import hashlib
+import os
 from time import sleep, time
-from typing import List
+from typing import Any, Dict, List, Optional
 
 
-@dataclass
 class Message:
-    role: str
-    content: str
-    persist: bool = False
+    """
+    An immutable chat message. Its content hash, token counts (per encoding) and API dict
+    are computed on first use and then kept with the message.
+    """
+    __slots__ = ("role", "content", "persist", "source", "_content_hash", "_token_counts", "_api_dict")
+
+    def __init__(self, role: str, content: str, persist: bool = False, source: Optional[str] = None):
+        object.__setattr__(self, "role", role)
+        object.__setattr__(self, "content", content)
+        object.__setattr__(self, "persist", persist)
+        # Where shown code came from, e.g. "main.py:Dog:bark"
+        object.__setattr__(self, "source", source)
+        object.__setattr__(self, "_content_hash", None)
+        object.__setattr__(self, "_token_counts", None)
+        object.__setattr__(self, "_api_dict", None)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError("Message is immutable")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError("Message is immutable")
+
+    def __reduce__(self):
+        return (Message, (self.role, self.content, self.persist, self.source))
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        # Messages pickled while Message was a dataclass, inside logs saved by old versions
+        Message.__init__(self, **state)
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, Message):
+            return NotImplemented
+        return (
+            (self.role, self.content, self.persist, self.source)
+            == (other.role, other.content, other.persist, other.source)
+        )
+
+    def __hash__(self) -> int:
+        return hash((self.role, self.content, self.persist, self.source))
+
+    def __repr__(self) -> str:
+        return (
+            f"Message(role={self.role!r}, content={self.content!r}, "
+            f"persist={self.persist!r}, source={self.source!r})"
+        )
 
     def __str__(self) -> str:
         return f"{self.role}: {self.content}"
 
+    @property
+    def content_hash(self) -> str:
+        if self._content_hash is None:
+            object.__setattr__(self, "_content_hash", hashlib.sha256(self.content.encode()).hexdigest())
+        return self._content_hash
+
+    def token_count(self, model: str) -> int:
+        if self._token_counts is None:
+            object.__setattr__(self, "_token_counts", {})
+        encoding = encoding_name(model)
+        if encoding not in self._token_counts:
+            self._token_counts[encoding] = count_tokens(self.content, model)
+        return self._token_counts[encoding]
+
+    @property
+    def api_dict(self) -> Dict[str, str]:
+        if self._api_dict is None:
+            object.__setattr__(self, "_api_dict", {"role": self.role, "content": self.content})
+        return self._api_dict
+
+
+@lru_cache(maxsize=None)
+def encoding_name(model: str) -> str:
+    from tiktoken.model import encoding_name_for_model
+    try:
+        return encoding_name_for_model(model)
+    except KeyError:
+        # e.g. "auto", which routes between models that all share this encoding
+        return "cl100k_base"
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str):
+    # Imported here since building an encoder is slow, and a daemon client never needs one
+    import tiktoken
+    return tiktoken.get_encoding(encoding_name(model))
+
+
+def count_tokens(text: str, model: str) -> int:
+    return len(get_encoding(model).encode(text))
+
 
 # Rate limiter
 last_call: float = time()
 
 
+@lru_cache(maxsize=None)
+def get_openai():
+    # Imported on the first model call, so that daemon clients never load the SDK
+    import openai
+    openai.api_key = os.getenv("OPENAI_API_KEY")
+    return openai
+
+
 # API for GPT
 def gpt_api(messages: List[Message], model: str, temperature: float) -> str:
     global last_call
@@ -32,15 +123,9 @@ def gpt_api(messages: List[Message], model: str, temperature: float) -> str:
         "gpt-3.5-turbo",
         "gpt-3.5-turbo-0301",
     ]:
-        response = openai.chat.completions.create(
+        response = get_openai().chat.completions.create(
             model=model,
-            messages=[
-                {
-                    "role": m.role,
-                    "content": m.content
-                }
-                for m in messages
-            ],
+            messages=[m.api_dict for m in messages],
             temperature=temperature,
             frequency_penalty=0,
             presence_penalty=0
@@ -57,7 +142,7 @@ def gpt_api(messages: List[Message], model: str, temperature: float) -> str:
         "babbage",
         "ada",
     ]:
-        response = openai.completions.create(
+        response = get_openai().completions.create(
             model=model,
             prompt="\n".join([f"{m.role}: {m.content}" for m in messages]) + "assistant: ",
             temperature=temperature,
@@ -1,15 +1,28 @@
 import builtins
 from dataclasses import dataclass, field
+import hashlib
 import os
 from pathlib import Path
-import pickle as pk
 from termcolor import colored
 import textwrap
-import tiktoken
-from typing import Any, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
 
 from singularity.color_scheme import Colors
-from singularity.llm import Message, llm_api
+from singularity import llm, routing
+from singularity.llm import Message
+from singularity.storage import (
+    BlobStore,
+    MessageStore,
+    blobs_dir,
+    entries_path,
+    load_index,
+    referenced_digests,
+    save_index,
+)
+
+
+# Shorter code blocks cost less to resend than a reference would
+min_dedupe_length = 200
 
 
 @dataclass
@@ -21,10 +34,17 @@ class Log:
     after_prune_threshold: int = 1500
     filename: Optional[str] = None
     title: Optional[str] = None
+    # Ingested chunks left out of the context, by chunk id -> blob digest
+    chunks: Dict[str, str] = field(default_factory=dict)
+    _store: Optional[MessageStore] = field(default=None, init=False, repr=False)
+    # id(message) -> (message, entry offset) for the messages in the log, so each message
+    # body is written only once
+    _stored: Dict[int, Tuple[Message, int]] = field(default_factory=dict, init=False, repr=False)
+    _context_cache: Optional[Tuple[Tuple[Message, ...], List[Message]]] = field(default=None, init=False, repr=False)
 
     def append(self, message: Message) -> None:
         self.log.append(message)
-        if self.length > self.prune_trigger:
+        if self.length > self.prune_limit:
             self.prune()
         self.__save__()
 
@@ -37,7 +57,7 @@ class Log:
             save_dir=self.save_dir,
             log=self.log + other.log,
         )
-        if new_log.length > self.prune_trigger:
+        if new_log.length > self.prune_limit:
             new_log.prune()
         self.log = new_log.log
         self.__save__()
@@ -47,12 +67,33 @@ class Log:
         if not os.path.exists(self.save_dir):
             os.makedirs(self.save_dir)
         if self.filename is None:
-            n_saved_logs = len([f for f in os.listdir(self.save_dir)])
+            n_saved_logs = len(saved_logs(self.save_dir))
             self.filename = f"log_{n_saved_logs}"
         save_path = self.save_dir / f"{self.filename}.txt"
         if self.title is None:
             self.title = self.filename
-        pk.dump(self, open(save_path, "wb"))
+        if self._store is None:
+            self._store = MessageStore(self.blobs, entries_path(save_path))
+        context = [self.__store_message__(message) for message in self.log]
+        # Only hold on to messages still in the log, so pruned and cleared ones can be freed
+        self._stored = {id(message): (message, entry) for message, entry in zip(self.log, context)}
+        header = {
+            "model": self.model,
+            "prune_trigger": self.prune_trigger,
+            "after_prune_threshold": self.after_prune_threshold,
+            "filename": self.filename,
+            "title": self.title,
+            "chunks": self.chunks,
+        }
+        save_index(save_path, header, self._store, context)
+
+    def __store_message__(self, message: Message) -> int:
+        stored = self._stored.get(id(message))
+        if stored is not None and stored[0] is message:
+            return stored[1]
+        entry = self._store.append(message)
+        self._stored[id(message)] = (message, entry)
+        return entry
 
     def rename(self, new_name: str) -> None:
         self.title = new_name
@@ -65,24 +106,91 @@ class Log:
         self.__save__()
 
     def load(self, filepath: Path):
-        with open(filepath, "rb") as f:
-            loaded_log = pk.load(f)
-            self.model = loaded_log.model
-            self.log = loaded_log.log
-            self.prune_trigger = loaded_log.prune_trigger
-            self.after_prune_threshold = loaded_log.after_prune_threshold
-            self.filename = loaded_log.filename
-            self.title = loaded_log.title
-        print(f"Loaded '{loaded_log.title}'", Colors.alert)
+        index = load_index(filepath)
+        self._store = None
+        self._stored = {}
+        if isinstance(index, dict):
+            self.model = index["model"]
+            self.prune_trigger = index["prune_trigger"]
+            self.after_prune_threshold = index["after_prune_threshold"]
+            self.filename = index["filename"]
+            self.title = index["title"]
+            self.chunks = index.get("chunks", {})
+            # Only the current context is read in; older bodies stay on disk until asked for
+            self._store = MessageStore(self.blobs, entries_path(filepath), index["entries_size"])
+            self.log = []
+            for offset, entry in zip(index["context"], self._store.entries(index["context"])):
+                message = self._store.read(entry)
+                self._stored[id(message)] = (message, offset)
+                self.log.append(message)
+        else:
+            # Log pickled whole by an older version, converted on next save
+            self.model = index.model
+            self.log = index.log
+            self.prune_trigger = index.prune_trigger
+            self.after_prune_threshold = index.after_prune_threshold
+            self.filename = index.filename
+            self.title = index.title
+            self.chunks = {}
+        print(f"Loaded '{self.title}'", Colors.alert)
         print()
 
+    @property
+    def blobs(self) -> BlobStore:
+        return BlobStore(blobs_dir(self.save_dir))
+
+    def read_chunk(self, chunk_id: str) -> Optional[str]:
+        if chunk_id not in self.chunks:
+            return None
+        return self.blobs.get(self.chunks[chunk_id])
+
+    def history(self) -> Iterator[Message]:
+        """Iterate over every saved message, including ones pruned from the context."""
+        if self._store is None:
+            yield from self.log
+            return
+        for entry in self._store.entries():
+            yield self._store.read(entry)
+
+    @property
+    def context(self) -> List[Message]:
+        """
+        The messages to send to the model. When the same code appears more than once, only
+        the newest copy is sent and older ones are replaced by a short reference. Rebuilt
+        only when the log has changed.
+        """
+        log_key = tuple(self.log)
+        if self._context_cache is not None and self._context_cache[0] == log_key:
+            return self._context_cache[1]
+        seen_sources = set()
+        seen_blocks = set()
+        context = []
+        for message in reversed(self.log):
+            if message.source is not None and message.source in seen_sources:
+                message = Message(
+                    role=message.role,
+                    content=f"[Code from {message.source} superseded by a later copy.]",
+                    persist=message.persist,
+                    source=message.source,
+                )
+            else:
+                if message.source is not None:
+                    seen_sources.add(message.source)
+                message = dedupe_code_blocks(message, seen_blocks)
+            context.append(message)
+        self._context_cache = (log_key, context[::-1])
+        return self._context_cache[1]
+
+    @property
+    def prune_limit(self) -> int:
+        """When routing between models, only prune once no model's context would fit."""
+        if self.model == routing.auto_model:
+            return routing.max_prompt_tokens()
+        return self.prune_trigger
+
     @property
     def length(self) -> int:
-        enc = tiktoken.encoding_for_model(self.model)
-        return sum([
-            len(enc.encode(message.content))
-            for message in self.log
-        ])
+        return sum([message.token_count(self.model) for message in self.context])
 
     def __iter__(self):
         return iter(self.log)
@@ -93,6 +201,11 @@ class Log:
         print(f"Log contains {self.length} tokens.", Colors.alert)
         print()
 
+    def print_history(self) -> None:
+        for message in self.history():
+            print(message, Colors.info)
+        print()
+
     def pop(self) -> Message:
         message = self.log.pop()
         self.__save__()
@@ -114,9 +227,10 @@ class Log:
 
     def prune(self):
         """Prune the log to a reasonable number of tokens."""
+        # Taken from the context, so repeated code is neither summarized nor counted twice
         messages = [
             message
-            for message in self.log
+            for message in self.context
             if not message.persist
         ]
         messages.append(
@@ -131,23 +245,29 @@ class Log:
         )
         print("Pruning log...", Colors.alert)
         try:
-            summary = "Summary of chat: " + llm_api(messages, self.model, 1)
+            model = routing.select_model(
+                self.model,
+                sum([message.token_count(self.model) for message in messages]),
+            )
+            summary = "Summary of chat: " + llm.llm_api(messages, model, 1)
             new_log = [
                 message
                 for message in self.log
                 if message.persist
             ] + [Message(role="assistant", content=summary)]
-            enc = tiktoken.encoding_for_model(self.model)
             new_log_length = sum([
-                len(enc.encode(message.content))
+                message.token_count(self.model)
                 for message in new_log
             ])
             n_messages_kept = 0
             messages.pop()
-            kept_messages_length = len(enc.encode(messages[-1].content))
-            while kept_messages_length + new_log_length < self.after_prune_threshold:
+            kept_messages_length = messages[-1].token_count(self.model)
+            while (
+                n_messages_kept < len(messages) - 1
+                and kept_messages_length + new_log_length < self.after_prune_threshold
+            ):
                 n_messages_kept += 1
-                kept_messages_length += len(enc.encode(messages[-n_messages_kept-1].content))
+                kept_messages_length += messages[-n_messages_kept-1].token_count(self.model)
             min_messages_kept = 3
             new_log += messages[-max(n_messages_kept, min_messages_kept):]
             self.log = new_log
@@ -156,10 +276,52 @@ class Log:
             print("Failed to prune log.\n", Colors.alert)
 
 
+def dedupe_code_blocks(message: Message, seen_blocks: Set[str]) -> Message:
+    """
+    Replaces code blocks in the message that are already in `seen_blocks` (hashes of newer
+    blocks) with a reference, and adds the message's remaining blocks to the set.
+    """
+    parts = message.content.split("```")
+    changed = False
+    # Code blocks are the odd parts; walk them newest first
+    for i in reversed(range(1, len(parts), 2)):
+        block = parts[i].strip()
+        if len(block) < min_dedupe_length:
+            continue
+        block_hash = hashlib.sha256(block.encode()).hexdigest()
+        if block_hash in seen_blocks:
+            parts[i] = "\n[Same code as shown later.]\n"
+            changed = True
+        else:
+            seen_blocks.add(block_hash)
+    if not changed:
+        return message
+    return Message(
+        role=message.role,
+        content="```".join(parts),
+        persist=message.persist,
+        source=message.source,
+    )
+
+
+def saved_logs(save_dir: Path) -> List[str]:
+    return [f for f in os.listdir(save_dir) if f.endswith(".txt")]
+
+
+def collect_garbage(save_dir: Path) -> int:
+    """Deletes stored message bodies that no saved log refers to any more."""
+    if not os.path.exists(save_dir):
+        return 0
+    index_paths = [save_dir / f for f in saved_logs(save_dir)]
+    blobs = BlobStore(blobs_dir(save_dir))
+    return blobs.collect_garbage(referenced_digests(index_paths))
+
+
 def get_title(filepath: Path) -> str:
-    with open(filepath, "rb") as f:
-        loaded_log = pk.load(f)
-        return loaded_log.title
+    index = load_index(filepath)
+    if isinstance(index, dict):
+        return index["title"]
+    return index.title
 
 
 def print(content: Any = "", color: str = Colors.info, indent: int = 0, end: str = '\n'):
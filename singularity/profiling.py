@@ -0,0 +1,67 @@
+from collections import Counter
+import cProfile
+from pathlib import Path
+import sys
+from threading import Event, Thread, get_ident
+from time import strftime
+from typing import Any, Callable
+
+from singularity.color_scheme import Colors
+from singularity.logs import print
+
+
+default_profile_dir = Path.home() / ".singularity_profiles"
+
+
+class TurnProfiler:
+    """
+    Profiles one REPL turn at a time. Each turn is run under cProfile while a thread samples
+    its stack, and writes a .pstats file plus a .collapsed file of stack counts that
+    flamegraph tools read. Nothing is hooked while profiling is off.
+    """
+    def __init__(self, profile_dir: Path = default_profile_dir, enabled: bool = False, sample_interval: float = 0.001):
+        self.profile_dir = profile_dir
+        self.enabled = enabled
+        self.sample_interval = sample_interval
+        self.n_turns = 0
+
+    def run(self, fn: Callable[..., Any], *args, skip: Callable[[Any], bool] = lambda result: False) -> Any:
+        """
+        Calls `fn` under the profiler. No profile is written if `skip(result)` is true, or
+        if the call itself turned profiling off.
+        """
+        stacks: Counter = Counter()
+        done = Event()
+        sampler = Thread(target=self.__sample__, args=(get_ident(), stacks, done), daemon=True)
+        profile = cProfile.Profile()
+        sampler.start()
+        profile.enable()
+        result = None
+        try:
+            result = fn(*args)
+            return result
+        finally:
+            profile.disable()
+            done.set()
+            sampler.join()
+            if self.enabled and not skip(result):
+                self.__write__(profile, stacks)
+
+    def __sample__(self, thread_id: int, stacks: Counter, done: Event) -> None:
+        while not done.wait(self.sample_interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f"{Path(frame.f_code.co_filename).stem}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            stacks[";".join(reversed(stack))] += 1
+
+    def __write__(self, profile: cProfile.Profile, stacks: Counter) -> None:
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        self.n_turns += 1
+        name = f"{strftime('%Y%m%d-%H%M%S')}_turn{self.n_turns}"
+        profile.dump_stats(self.profile_dir / f"{name}.pstats")
+        with open(self.profile_dir / f"{name}.collapsed", "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        print(f"Wrote profile {self.profile_dir / name}.pstats\n", Colors.info)
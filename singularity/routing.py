@@ -0,0 +1,92 @@
+import json
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Tuple
+
+from singularity.color_scheme import Colors
+
+
+auto_model = "auto"
+default_rules_path = Path.home() / ".singularity_routing.json"
+
+
+class RoutingRule(NamedTuple):
+    model: str
+    context_window: int
+
+
+# Cheapest and fastest first
+default_rules = [
+    RoutingRule("gpt-3.5-turbo", 4096),
+    RoutingRule("gpt-4", 8192),
+    RoutingRule("gpt-4-32k", 32768),
+]
+default_response_reserve = 1000
+
+
+class RoutingConfig(NamedTuple):
+    response_reserve: int
+    rules: List[RoutingRule]
+
+
+default_config = RoutingConfig(default_response_reserve, default_rules)
+# rules path -> (modification time, parsed config)
+config_cache: Dict[Path, Tuple[int, RoutingConfig]] = {}
+
+
+def load_rules(rules_path: Path = default_rules_path) -> RoutingConfig:
+    """
+    Reads the routing rules, writing out the defaults on first use so they can be edited.
+    Rules are tried in order, and `response_reserve` tokens are kept free for the reply.
+    The file is only parsed again once it changes; if it is invalid, the defaults are used.
+    """
+    try:
+        if not rules_path.exists():
+            with open(rules_path, "w") as f:
+                json.dump(
+                    {
+                        "response_reserve": default_response_reserve,
+                        "rules": [rule._asdict() for rule in default_rules],
+                    },
+                    f,
+                    indent=4,
+                )
+        mtime_ns = rules_path.stat().st_mtime_ns
+    except OSError:
+        return default_config
+    cached = config_cache.get(rules_path)
+    if cached is not None and cached[0] == mtime_ns:
+        return cached[1]
+    try:
+        with open(rules_path) as f:
+            rules = json.load(f)
+        config = RoutingConfig(
+            int(rules["response_reserve"]),
+            [RoutingRule(str(rule["model"]), int(rule["context_window"])) for rule in rules["rules"]],
+        )
+        if len(config.rules) == 0:
+            raise ValueError("no rules")
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        # Imported here since logs imports this module
+        from singularity.logs import print
+        print(f"Invalid routing rules in {rules_path} ({e}), using the defaults.\n", Colors.alert)
+        config = default_config
+    config_cache[rules_path] = (mtime_ns, config)
+    return config
+
+
+def route(n_tokens: int, rules_path: Path = default_rules_path) -> str:
+    """Returns the first model whose context window fits the prompt, or the largest one."""
+    config = load_rules(rules_path)
+    for rule in config.rules:
+        if n_tokens + config.response_reserve <= rule.context_window:
+            return rule.model
+    return max(config.rules, key=lambda rule: rule.context_window).model
+
+
+def max_prompt_tokens(rules_path: Path = default_rules_path) -> int:
+    config = load_rules(rules_path)
+    return max(rule.context_window for rule in config.rules) - config.response_reserve
+
+
+def select_model(model: str, n_tokens: int) -> str:
+    return route(n_tokens) if model == auto_model else model
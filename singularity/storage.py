@@ -0,0 +1,162 @@
+import hashlib
+import os
+from pathlib import Path
+import pickle as pk
+from time import time
+import zlib
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Set
+
+from singularity.llm import Message
+
+
+INDEX_VERSION = 3
+
+
+class IndexEntry(NamedTuple):
+    digest: str
+    role: str
+    persist: bool
+    source: Optional[str] = None
+
+
+class BlobStore:
+    """
+    Content-addressed store of zlib-compressed message bodies, shared by every log in a
+    save directory. A body is written once no matter how many messages or logs refer to it.
+    """
+    def __init__(self, root: Path):
+        self.root = root
+
+    def path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest[2:]
+
+    def put(self, content: str) -> str:
+        data = content.encode()
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if path.exists():
+            # Mark as recently used so a concurrent garbage collection leaves it alone
+            os.utime(path)
+            return digest
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(zlib.compress(data))
+        os.replace(tmp_path, path)
+        return digest
+
+    def get(self, digest: str) -> str:
+        with open(self.path(digest), "rb") as f:
+            return zlib.decompress(f.read()).decode()
+
+    def digests(self) -> Iterator[str]:
+        if not self.root.exists():
+            return
+        for prefix in os.listdir(self.root):
+            for name in os.listdir(self.root / prefix):
+                if not name.endswith(".tmp"):
+                    yield prefix + name
+
+    def collect_garbage(self, referenced: Set[str], grace_period: float = 3600) -> int:
+        """
+        Deletes blobs not in `referenced`. Blobs touched within the grace period are kept,
+        since another session may have written them without having saved its index yet.
+        """
+        n_removed = 0
+        cutoff = time() - grace_period
+        for digest in list(self.digests()):
+            path = self.path(digest)
+            if digest not in referenced and path.stat().st_mtime < cutoff:
+                path.unlink()
+                n_removed += 1
+        return n_removed
+
+
+class MessageStore:
+    """
+    Every message saved to one log, in order, as records appended to the log's entries
+    file. A record holds a reference into the shared blob store and is never rewritten,
+    so saving costs only the new messages. Messages are named by their record's offset.
+    """
+    def __init__(self, blobs: BlobStore, path: Path, size: int = 0):
+        self.blobs = blobs
+        self.path = path
+        # Bytes of the file that an index refers to; anything after is from an unfinished save
+        self.size = size
+
+    def append(self, message: Message) -> int:
+        digest = self.blobs.put(message.content)
+        entry = IndexEntry(digest, message.role, message.persist, message.source)
+        with open(self.path, "r+b" if self.path.exists() else "wb") as f:
+            f.seek(self.size)
+            f.truncate()
+            pk.dump(tuple(entry), f)
+            offset, self.size = self.size, f.tell()
+        return offset
+
+    def entries(self, offsets: Optional[List[int]] = None) -> Iterator[IndexEntry]:
+        """Reads the records at `offsets`, or every record in order."""
+        return read_entries(self.path, self.size, offsets)
+
+    def read(self, entry: IndexEntry) -> Message:
+        return Message(
+            role=entry.role,
+            content=self.blobs.get(entry.digest),
+            persist=entry.persist,
+            source=entry.source,
+        )
+
+
+def read_entries(path: Path, size: int, offsets: Optional[List[int]] = None) -> Iterator[IndexEntry]:
+    if size == 0:
+        return
+    with open(path, "rb") as f:
+        if offsets is None:
+            while f.tell() < size:
+                yield IndexEntry(*pk.load(f))
+        else:
+            for offset in offsets:
+                f.seek(offset)
+                yield IndexEntry(*pk.load(f))
+
+
+def blobs_dir(save_dir: Path) -> Path:
+    return save_dir / "blobs"
+
+
+def entries_path(index_path: Path) -> Path:
+    return index_path.with_suffix(".entries")
+
+
+def save_index(index_path: Path, header: Dict[str, Any], store: MessageStore, context: List[int]) -> None:
+    """Rewrites the index, which holds only the header and the context's record offsets."""
+    index = dict(
+        header,
+        version=INDEX_VERSION,
+        entries_size=store.size,
+        context=context,
+    )
+    tmp_path = index_path.with_suffix(".tmp")
+    with open(tmp_path, "wb") as f:
+        pk.dump(index, f)
+    os.replace(tmp_path, index_path)
+
+
+def load_index(index_path: Path) -> Any:
+    """
+    Returns the index dict for a saved log, or the unpickled Log itself for logs saved
+    before the indexed format existed.
+    """
+    with open(index_path, "rb") as f:
+        return pk.load(f)
+
+
+def referenced_digests(index_paths: List[Path]) -> Set[str]:
+    referenced = set()
+    for index_path in index_paths:
+        index = load_index(index_path)
+        if isinstance(index, dict) and index["version"] == INDEX_VERSION:
+            entries = read_entries(entries_path(index_path), index["entries_size"])
+            referenced.update(entry.digest for entry in entries)
+            referenced.update(index.get("chunks", {}).values())
+    return referenced
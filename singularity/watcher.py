@@ -0,0 +1,181 @@
+import ctypes
+import ctypes.util
+import os
+from pathlib import Path
+import select
+import struct
+import sys
+from threading import Condition, Thread
+from time import sleep, time
+from typing import Dict, Optional, Set, Tuple
+
+from singularity.code import CodebaseIndex, codebase_files, get_index, is_ignored
+
+
+# inotify constants, from <sys/inotify.h>
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_ISDIR = 0x40000000
+watch_mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+event_header = struct.Struct("iIII")
+
+
+class CodebaseWatcher:
+    """
+    Keeps a CodebaseIndex up to date in the background. File changes are reported by
+    inotify on Linux, or found by polling elsewhere, and re-parsed on a worker thread once
+    a file has stopped changing for `debounce` seconds.
+    """
+    def __init__(self, index: CodebaseIndex, debounce: float = 0.2, poll_interval: float = 1):
+        self.index = index
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.pending: Set[Path] = set()
+        self.last_change = 0.0
+        self.changed = Condition()
+        self.running = False
+
+    def start(self) -> None:
+        self.running = True
+        inotify_fd = self.__inotify_init__()
+        if inotify_fd is None:
+            Thread(target=self.__poll__, daemon=True).start()
+        else:
+            Thread(target=self.__watch_inotify__, args=(inotify_fd,), daemon=True).start()
+        Thread(target=self.__reparse__, daemon=True).start()
+
+    def stop(self) -> None:
+        self.running = False
+        self.index.watched = False
+        with self.changed:
+            self.changed.notify()
+
+    def __notify__(self, rel_filepath: Path) -> None:
+        if is_ignored(str(rel_filepath)):
+            return
+        if rel_filepath.suffix != ".py" and rel_filepath not in self.index.files:
+            return
+        with self.changed:
+            self.pending.add(rel_filepath)
+            self.last_change = time()
+            self.changed.notify()
+
+    def __reparse__(self) -> None:
+        # Initial scan; the index is only trusted once every file is in it
+        for rel_filepath in codebase_files(self.index.directory):
+            self.index.refresh(rel_filepath)
+        self.index.watched = self.running
+        while self.running:
+            with self.changed:
+                while self.running and (
+                    len(self.pending) == 0
+                    or time() - self.last_change < self.debounce
+                ):
+                    timeout = None if len(self.pending) == 0 else self.debounce
+                    self.changed.wait(timeout)
+                pending, self.pending = self.pending, set()
+            for rel_filepath in pending:
+                self.index.refresh(rel_filepath)
+
+    def __poll__(self) -> None:
+        snapshot = self.__snapshot__()
+        while self.running:
+            sleep(self.poll_interval)
+            new_snapshot = self.__snapshot__()
+            for rel_filepath in snapshot.keys() | new_snapshot.keys():
+                if snapshot.get(rel_filepath) != new_snapshot.get(rel_filepath):
+                    self.__notify__(rel_filepath)
+            snapshot = new_snapshot
+
+    def __snapshot__(self) -> Dict[Path, Tuple[int, int]]:
+        snapshot = {}
+        for rel_filepath in codebase_files(self.index.directory):
+            try:
+                stat = os.stat(self.index.directory / rel_filepath)
+            except FileNotFoundError:
+                continue
+            snapshot[rel_filepath] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def __inotify_init__(self) -> Optional[int]:
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        self.watch_dirs: Dict[int, Path] = {}
+        for root, _, _ in os.walk(self.index.directory):
+            if not is_ignored(root):
+                self.__add_watch__(fd, Path(root))
+        return fd
+
+    def __add_watch__(self, fd: int, directory: Path) -> None:
+        wd = self.libc.inotify_add_watch(fd, str(directory).encode(), watch_mask)
+        if wd >= 0:
+            self.watch_dirs[wd] = directory
+
+    def __remove_dir__(self, fd: int, directory: Path) -> None:
+        for wd, watched_dir in list(self.watch_dirs.items()):
+            if watched_dir == directory or directory in watched_dir.parents:
+                # Already gone if the directory was deleted; still live if it was moved away
+                self.libc.inotify_rm_watch(fd, wd)
+                del self.watch_dirs[wd]
+        self.index.forget(directory.relative_to(self.index.directory))
+
+    def __rescan__(self, fd: int) -> None:
+        watched_dirs = set(self.watch_dirs.values())
+        for root, _, _ in os.walk(self.index.directory):
+            if not is_ignored(root) and Path(root) not in watched_dirs:
+                self.__add_watch__(fd, Path(root))
+        for rel_filepath in set(self.index.files) | set(codebase_files(self.index.directory)):
+            self.__notify__(rel_filepath)
+
+    def __watch_inotify__(self, fd: int) -> None:
+        while self.running:
+            ready, _, _ = select.select([fd], [], [], 1)
+            if len(ready) == 0:
+                continue
+            buffer = os.read(fd, 65536)
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, name_length = event_header.unpack_from(buffer, offset)
+                offset += event_header.size
+                name = buffer[offset:offset + name_length].rstrip(b"\0").decode()
+                offset += name_length
+                if mask & IN_Q_OVERFLOW:
+                    # Events were dropped, so nothing in the index can be trusted
+                    self.__rescan__(fd)
+                    continue
+                if wd not in self.watch_dirs or name == "":
+                    continue
+                path = self.watch_dirs[wd] / name
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO) and not is_ignored(str(path)):
+                        self.__add_watch__(fd, path)
+                        for rel_filepath in codebase_files(path):
+                            self.__notify__(path.relative_to(self.index.directory) / rel_filepath)
+                    elif mask & (IN_DELETE | IN_MOVED_FROM):
+                        self.__remove_dir__(fd, path)
+                    continue
+                self.__notify__(path.relative_to(self.index.directory))
+        os.close(fd)
+
+
+watchers: Dict[Path, CodebaseWatcher] = {}
+
+
+def watch(directory: Path) -> CodebaseWatcher:
+    """Starts a watcher for the directory's codebase index, unless one is already running."""
+    if directory not in watchers:
+        watchers[directory] = CodebaseWatcher(get_index(directory))
+        watchers[directory].start()
+    return watchers[directory]
@@ -0,0 +1,29 @@
+from pathlib import Path
+
+from singularity.code import CodebaseIndex
+
+
+def test_watched_index_checks_files_outside_the_directory(tmp_path: Path):
+    (tmp_path / "project").mkdir()
+    (tmp_path / "outside.py").write_text("a = 1\n")
+    index = CodebaseIndex(tmp_path / "project")
+    index.watched = True
+    assert index.get(Path("../outside.py")).contents == "a = 1\n"
+    (tmp_path / "outside.py").write_text("a = 22\n")
+    # No watcher sees this file, so the change is picked up by its size and mtime
+    assert index.get(Path("../outside.py")).contents == "a = 22\n"
+
+
+def test_refresh_keeps_last_version_that_parsed(tmp_path: Path):
+    (tmp_path / "a.py").write_text("def f():\n    pass\n")
+    index = CodebaseIndex(tmp_path)
+    summary = index.summary(Path("a.py"), False)
+    (tmp_path / "a.py").write_text("def f(:\n")
+    index.refresh(Path("a.py"))
+    assert index.files[Path("a.py")].contents == "def f():\n    pass\n"
+    assert index.summaries[(Path("a.py"), False)][1] == summary
+
+    (tmp_path / "a.py").unlink()
+    index.refresh(Path("a.py"))
+    assert Path("a.py") not in index.files
+    assert (Path("a.py"), False) not in index.summaries
@@ -0,0 +1,25 @@
+import io
+from pathlib import Path
+from typing import List
+
+from singularity import llm
+from singularity.ingest import ingest
+from singularity.logs import Log
+
+
+def test_ingest_estimates_tokens_past_the_budget(tmp_path: Path, monkeypatch):
+    counted: List[str] = []
+
+    def count_tokens(text: str, model: str) -> int:
+        counted.append(text)
+        return len(text.split())
+
+    monkeypatch.setattr(llm, "encoding_name", lambda model: "words")
+    monkeypatch.setattr(llm, "count_tokens", count_tokens)
+    log = Log(model="gpt-4", save_dir=tmp_path, prune_trigger=2000)
+    text = "word\n" * 20000
+    attached, stored = ingest(io.StringIO(text), log, "paste0")
+    assert len(stored) > 1
+    # Only the pieces read before the budget ran out were counted, out of about a hundred
+    assert len(counted) < 10
+    assert "".join([attached] + [log.read_chunk(chunk.chunk_id) for chunk in stored]) == text
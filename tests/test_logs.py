@@ -0,0 +1,45 @@
+from pathlib import Path
+from typing import List
+
+from singularity import llm
+from singularity.llm import Message
+from singularity.logs import Log
+
+
+def test_prune_counts_repeated_code_once(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(llm, "encoding_name", lambda model: "words")
+    monkeypatch.setattr(llm, "count_tokens", lambda text, model: len(text.split()))
+    summarized: List[List[Message]] = []
+
+    def llm_api(messages: List[Message], model: str, temperature: float) -> str:
+        summarized.append(messages)
+        return "we looked at a.py"
+
+    monkeypatch.setattr(llm, "llm_api", llm_api)
+    code = "```\n" + "x = 1\n" * 100 + "```"
+    log = Log(model="gpt-4", save_dir=tmp_path, prune_trigger=600, after_prune_threshold=640)
+    for _ in range(5):
+        log.append(Message(role="user", content=code, source="a.py::"))
+        log.append(Message(role="assistant", content="ok"))
+    # Five copies are in the log, but only the newest is in the context
+    assert len(summarized) == 0
+
+    log.append(Message(role="user", content="word " * 300))
+    assert len(summarized) == 1
+    assert sum(code in message.content for message in summarized[0]) == 1
+    # The kept tail was sized by context counts, so it reaches past the newest copy
+    shown = [message for message in log.log if message.source == "a.py::"]
+    assert len(shown) >= 3
+    assert sum(message.content == code for message in shown) == 1
+
+
+def test_save_forgets_removed_messages(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(llm, "encoding_name", lambda model: "words")
+    monkeypatch.setattr(llm, "count_tokens", lambda text, model: len(text.split()))
+    log = Log(model="gpt-4", save_dir=tmp_path)
+    for i in range(10):
+        log.append(Message(role="user", content=f"message {i}"))
+    log.clear()
+    log.append(Message(role="user", content="again"))
+    assert len(log._stored) == 1
+    assert len(list(log.history())) == 11
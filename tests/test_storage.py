@@ -0,0 +1,119 @@
+import os
+from pathlib import Path
+import pickle as pk
+from time import time
+
+from singularity.llm import Message
+from singularity.logs import Log, collect_garbage
+from singularity.storage import BlobStore, MessageStore, entries_path, load_index, referenced_digests, save_index
+
+
+def make_old(blobs: BlobStore, digest: str) -> None:
+    old = time() - 2 * 3600
+    os.utime(blobs.path(digest), (old, old))
+
+
+def test_put_get_round_trip(tmp_path: Path):
+    blobs = BlobStore(tmp_path / "blobs")
+    content = "def f():\n    return 1\n" * 100
+    digest = blobs.put(content)
+    assert blobs.get(digest) == content
+    # Stored compressed
+    assert blobs.path(digest).stat().st_size < len(content.encode())
+
+
+def test_put_deduplicates(tmp_path: Path):
+    blobs = BlobStore(tmp_path / "blobs")
+    assert blobs.put("same") == blobs.put("same")
+    assert blobs.put("same") != blobs.put("other")
+    assert len(list(blobs.digests())) == 2
+
+
+def test_put_refreshes_existing_blob(tmp_path: Path):
+    blobs = BlobStore(tmp_path / "blobs")
+    digest = blobs.put("body")
+    make_old(blobs, digest)
+    blobs.put("body")
+    assert blobs.collect_garbage(set()) == 0
+
+
+def test_collect_garbage_removes_only_old_unreferenced(tmp_path: Path):
+    blobs = BlobStore(tmp_path / "blobs")
+    kept = blobs.put("referenced")
+    removed = blobs.put("unreferenced")
+    recent = blobs.put("unreferenced but recent")
+    make_old(blobs, kept)
+    make_old(blobs, removed)
+    assert blobs.collect_garbage({kept}) == 1
+    assert set(blobs.digests()) == {kept, recent}
+    assert blobs.get(kept) == "referenced"
+
+
+def test_collect_garbage_without_blobs(tmp_path: Path):
+    assert BlobStore(tmp_path / "blobs").collect_garbage(set()) == 0
+
+
+def test_referenced_digests(tmp_path: Path):
+    blobs = BlobStore(tmp_path / "blobs")
+    store = MessageStore(blobs, entries_path(tmp_path / "log_0.txt"))
+    pruned = store.append(Message(role="user", content="pruned message"))
+    kept = store.append(Message(role="user", content="message"))
+    chunk_digest = blobs.put("chunk")
+    save_index(tmp_path / "log_0.txt", {"title": "log_0", "chunks": {"paste0#1": chunk_digest}}, store, [kept])
+    # Messages pruned from the context are still referenced by the log's history
+    assert referenced_digests([tmp_path / "log_0.txt"]) == {
+        entry.digest for entry in store.entries([pruned, kept])
+    } | {chunk_digest}
+
+
+def test_append_drops_unfinished_records(tmp_path: Path):
+    blobs = BlobStore(tmp_path / "blobs")
+    path = entries_path(tmp_path / "log_0.txt")
+    store = MessageStore(blobs, path)
+    store.append(Message(role="user", content="saved"))
+    # Appended by a save that never wrote its index
+    MessageStore(blobs, path, store.size).append(Message(role="user", content="lost"))
+    store.append(Message(role="user", content="next"))
+    assert [store.read(entry).content for entry in store.entries()] == ["saved", "next"]
+
+
+def test_save_appends_only_new_entries(tmp_path: Path):
+    log = Log(model="gpt-3.5-turbo", save_dir=tmp_path, log=[Message(role="user", content="first")])
+    log.rename("saved")
+    index_path = tmp_path / "log_0.txt"
+    saved = entries_path(index_path).read_bytes()
+    log.log = [Message(role="assistant", content="second")]
+    log.rename("saved again")
+    # The earlier record is left as it was and only the new one is appended
+    entries = entries_path(index_path).read_bytes()
+    assert entries.startswith(saved) and len(entries) > len(saved)
+    assert len(load_index(index_path)["context"]) == 1
+
+    loaded = Log(model="gpt-3.5-turbo", save_dir=tmp_path)
+    loaded.load(index_path)
+    assert [message.content for message in loaded.log] == ["second"]
+    assert [message.content for message in loaded.history()] == ["first", "second"]
+
+
+def test_referenced_digests_skips_pickled_logs(tmp_path: Path):
+    # Logs saved before the blob store existed are pickled whole and reference no blobs
+    legacy_log = Log(model="gpt-3.5-turbo", save_dir=tmp_path, log=[Message(role="user", content="old")])
+    with open(tmp_path / "log_0.txt", "wb") as f:
+        pk.dump(legacy_log, f)
+    assert referenced_digests([tmp_path / "log_0.txt"]) == set()
+
+
+def test_collect_garbage_keeps_log_and_chunk_blobs(tmp_path: Path):
+    log = Log(model="gpt-3.5-turbo", save_dir=tmp_path)
+    log.chunks["paste0#1"] = log.blobs.put("stored chunk")
+    log.rename("kept")
+    orphan = log.blobs.put("orphan")
+    for digest in list(log.blobs.digests()):
+        make_old(log.blobs, digest)
+    assert collect_garbage(tmp_path) == 1
+    assert not log.blobs.path(orphan).exists()
+    assert log.read_chunk("paste0#1") == "stored chunk"
+
+
+def test_collect_garbage_without_save_dir(tmp_path: Path):
+    assert collect_garbage(tmp_path / "missing") == 0